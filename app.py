@@ -1,8 +1,8 @@
 # app.py
 import streamlit as st
 from docx_utils import parse_docx_documents, insert_review_notes_and_save
-from classifier import classify_doc_type, detect_process
-import json, tempfile, os, logging, time
+from classifier import classify_doc_type, detect_process, detect_red_flag_markers
+import json, tempfile, os, logging, time, hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -42,21 +42,61 @@ with st.sidebar:
                     logging.error(f"Ingest failed: {e}")
                     st.error(f"Ingest failed: {e}")
 
+REVIEW_PROMPT_TEMPLATE = """SYSTEM: You are a legal compliance assistant specialized in Abu Dhabi Global Market (ADGM) regulations.
+User: Review the following documents. For each document, return a JSON array (list) of identified issues with keys: section, issue, severity, suggestion. Return a top-level JSON object mapping document types to their issues.
+
+DOCUMENTS:
+{documents}
+"""
+# Gemini rejects requests over ~4MB; above this many UTF-8 bytes send one prompt per document instead
+MAX_COMBINED_PROMPT_BYTES = 3_000_000
+# used to keep the more severe of two duplicate issues
+SEVERITY_RANK = {"critical": 4, "high": 3, "major": 3, "medium": 2, "minor": 1, "low": 1}
+
+
+def _severity_rank(issue):
+    return SEVERITY_RANK.get(str(issue.get("severity") or "").strip().lower(), 0)
+
+
+def _save_upload(up, path, chunk_size=64 * 1024):
+    """
+    Stream an uploaded file to path in chunks (bounded memory) and return the SHA-256 of its bytes.
+    """
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: up.read(chunk_size), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _parse_and_classify(content_hashes, _paths):
+    """
+    Parse + classify uploaded docs; cached on the content hashes so reruns with the same
+    uploads skip docx parsing. _paths is excluded from the cache key (tmp dirs differ per rerun).
+    """
+    docs = parse_docx_documents(_paths)
+    for d in docs:
+        d["predicted_type"] = classify_doc_type(d["text"])
+    return docs
+
 uploaded_files = st.file_uploader("Upload one or more .docx files", type=["docx"], accept_multiple_files=True)
 
 if uploaded_files:
     tmpdir = tempfile.mkdtemp(prefix="adgm_upl_")
     saved_paths = []
+    content_hashes = []
     for up in uploaded_files:
         path = os.path.join(tmpdir, up.name)
-        with open(path, "wb") as f:
-            f.write(up.read())
+        content_hashes.append(_save_upload(up, path))
         saved_paths.append(path)
 
     st.success(f"Saved {len(saved_paths)} files.")
-    docs = parse_docx_documents(saved_paths)
-    for d in docs:
-        d["predicted_type"] = classify_doc_type(d["text"])
+    docs = _parse_and_classify(tuple(content_hashes), saved_paths)
+    # cached entries carry the paths of the run that populated them; point at this run's files
+    for d, path in zip(docs, saved_paths):
+        d["path"] = path
     process = detect_process([d["predicted_type"] for d in docs])
     st.markdown(f"**Detected process:** {process}")
 
@@ -95,13 +135,24 @@ if uploaded_files:
     elif not rag_available:
         st.warning("RAG collection not found. RAG-based checks will be skipped until you ingest reference docs.")
 
+    # If RAG available, retrieve context for all docs with a single batched embedding + query
+    rag_contexts = [""] * len(docs)
+    if rag_utils and rag_available:
+        query_texts = [d["text"][:2000] for d in docs]
+        try:
+            rag_contexts = rag_utils.retrieve_relevant_clauses_batch(query_texts, top_k=3)
+        except Exception as e:
+            logging.warning(f"RAG retrieval failed: {e}")
+            rag_contexts = [""] * len(docs)
+
     # Basic rule-based checks and prepare RAG inputs
     rag_prompts = []
     flagged_docs_for_rag = []
-    for d in docs:
-        text = d["text"]
+    for d, top_k_ctx in zip(docs, rag_contexts):
+        # one scan answers every keyword-based check
+        markers = detect_red_flag_markers(d["text"])
         # Basic checks
-        if ("adgm" not in text.lower()) and ("abu dhabi global market" not in text.lower()):
+        if "jurisdiction" not in markers:
             issues_found.append({
                 "document": d["predicted_type"],
                 "section": "Jurisdiction clause",
@@ -109,7 +160,7 @@ if uploaded_files:
                 "severity": "High",
                 "suggestion": "Update jurisdiction to Abu Dhabi Global Market (ADGM) Courts."
             })
-        if ("signature" not in text.lower()) and ("signed" not in text.lower()):
+        if "signature" not in markers:
             issues_found.append({
                 "document": d["predicted_type"],
                 "section": "Signatory section",
@@ -118,15 +169,6 @@ if uploaded_files:
                 "suggestion": "Add signatory name, title and date."
             })
 
-        # If RAG available, prepare retrieval context for each doc
-        top_k_ctx = ""
-        if rag_utils and rag_available:
-            try:
-                top_k_ctx = rag_utils.retrieve_relevant_clauses(d["text"], top_k=3)
-            except Exception as e:
-                logging.warning(f"RAG retrieval failed for {d['predicted_type']}: {e}")
-                top_k_ctx = ""
-
         # We'll only send docs with potential issues to Gemini (to reduce quota usage)
         # Construct a compact prompt for each doc and accumulate
         doc_summary = {
@@ -137,33 +179,42 @@ if uploaded_files:
         flagged_docs_for_rag.append(doc_summary)
 
     # Batch all flagged docs into one Gemini prompt if Gemini is available
-    gemini_response = None
+    # (gemini_response, document type) pairs; the type is None for the combined multi-document prompt
+    gemini_responses = []
     if rag_utils and rag_utils.api_key_available():
         try:
-            # Build a single combined prompt to analyze all uploaded docs at once
-            combined_docs_text = ""
+            doc_sections = []
             for dd in flagged_docs_for_rag:
-                combined_docs_text += f"DOCUMENT TYPE: {dd['predicted_type']}\n{dd['text_preview']}\n\n"
+                section = f"DOCUMENT TYPE: {dd['predicted_type']}\n{dd['text_preview']}\n\n"
                 if dd.get("context"):
-                    combined_docs_text += f"RELEVANT ADGM CONTEXT:\n{dd['context']}\n\n"
-                combined_docs_text += "----\n\n"
+                    section += f"RELEVANT ADGM CONTEXT:\n{dd['context']}\n\n"
+                section += "----\n\n"
+                doc_sections.append(section)
+            combined_docs_text = "".join(doc_sections)
 
-            prompt = f"""SYSTEM: You are a legal compliance assistant specialized in Abu Dhabi Global Market (ADGM) regulations.
-User: Review the following documents. For each document, return a JSON array (list) of identified issues with keys: section, issue, severity, suggestion. Return a top-level JSON object mapping document types to their issues.
-
-DOCUMENTS:
-{combined_docs_text}
-"""
-            # single call for all documents
-            gemini_response = rag_utils.call_gemini_with_context(
-                prompt,
-                system_message="Legal assistant: ADGM rules apply",
-                model_name="gemini-1.5-flash"
-            )
+            if len(combined_docs_text.encode("utf-8")) <= MAX_COMBINED_PROMPT_BYTES:
+                # single call for all documents
+                gemini_response = rag_utils.call_gemini_with_context(
+                    REVIEW_PROMPT_TEMPLATE.format(documents=combined_docs_text),
+                    system_message="Legal assistant: ADGM rules apply",
+                    model_name="gemini-1.5-flash"
+                )
+                gemini_responses.append((gemini_response, None))
+            else:
+                # too large for one request: one prompt per document, a few at a time
+                responses = rag_utils.call_gemini_batch(
+                    [REVIEW_PROMPT_TEMPLATE.format(documents=sec) for sec in doc_sections],
+                    system_message="Legal assistant: ADGM rules apply",
+                    model_name="gemini-1.5-flash"
+                )
+                for dd, (gemini_response, error) in zip(flagged_docs_for_rag, responses):
+                    if error is not None:
+                        logging.error(f"Gemini call failed for {dd['predicted_type']}: {error}")
+                    gemini_responses.append((gemini_response, dd["predicted_type"]))
         except Exception as e:
             # robust fallback if Gemini fails (rate limit / quota / network)
             logging.error(f"Gemini call failed: {e}")
-            gemini_response = None
+            gemini_responses = []
     else:
         # not available: mark that Gemini wasn't used
         for d in docs:
@@ -175,8 +226,10 @@ DOCUMENTS:
                 "suggestion": "Set GEMINI_API_KEY and ingest references, or check quota."
             })
 
-    # Parse gemini response if present
-    if gemini_response:
+    # Parse gemini responses if present
+    for gemini_response, response_doc_type in gemini_responses:
+        if not gemini_response:
+            continue
         try:
             cleaned = rag_utils._clean_gemini_output(gemini_response) if rag_utils else gemini_response.strip()
             parsed = json.loads(cleaned)
@@ -192,6 +245,8 @@ DOCUMENTS:
                 # fallback: treat as list of issues without doc grouping
                 for p in parsed:
                     if isinstance(p, dict):
+                        if response_doc_type and not p.get("document"):
+                            p["document"] = response_doc_type
                         issues_found.append(p)
             else:
                 # unrecognized structure - attach raw
@@ -212,6 +267,20 @@ DOCUMENTS:
                 "suggestion": "Manual review recommended."
             })
 
+    # Deduplicate overlapping rule-based / Gemini issues per document, keeping the higher severity
+    deduped = {}
+    for iss in issues_found:
+        key = (
+            iss.get("document"),
+            str(iss.get("section") or "").lower(),
+            str(iss.get("issue") or "")[:120].lower(),
+        )
+        kept = deduped.get(key)
+        if kept is None or _severity_rank(iss) > _severity_rank(kept):
+            # dict keeps first-insertion order, so replacing a value doesn't move the issue
+            deduped[key] = iss
+    issues_found = list(deduped.values())
+
     # Build final report
     report = {
         "process": process,
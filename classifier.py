@@ -1,29 +1,60 @@
 import re
 
+# (group name, document type, keyword alternation) in priority order; handles common abbreviations and variants
+_DOC_TYPE_PATTERNS = [
+    ("aoa", "Articles of Association", r"aoa|articles of association|article of association"),
+    ("moa", "Memorandum of Association", r"moa|memorandum of association|memorandum"),
+    ("ubo", "UBO Declaration Form", r"ubo|ultimate beneficial owner|ultimate beneficial owner declaration"),
+    ("register", "Register of Members and Directors", r"register of members and directors|register of members|register of directors"),
+    ("incorporation", "Incorporation Application Form", r"incorporation application|application for incorporation|application to incorporate|incorporation form"),
+]
+# one alternation so a single pass over the text finds every category present
+_DOC_TYPE_RE = re.compile(
+    r"\b(?:" + "|".join(f"(?P<{name}>{alts})" for name, _, alts in _DOC_TYPE_PATTERNS) + r")\b",
+    re.I,
+)
+_DOC_TYPE_PRIORITY = {name: (rank, doc_type) for rank, (name, doc_type, _) in enumerate(_DOC_TYPE_PATTERNS)}
+
 
 def classify_doc_type(text: str) -> str:
-    text_l = text.lower()
-    # handle common abbreviations and variants
-    if re.search(r"\b(aoa|articles of association|article of association)\b", text_l):
-        return "Articles of Association"
-    if re.search(r"\b(moa|memorandum of association|memorandum)\b", text_l):
-        return "Memorandum of Association"
-    if re.search(r"\b(ubo|ultimate beneficial owner|ultimate beneficial owner declaration)\b", text_l):
-        return "UBO Declaration Form"
-    if re.search(r"\b(register of members and directors|register of members|register of directors)\b", text_l):
-        return "Register of Members and Directors"
-    if re.search(r"\b(incorporation application|application for incorporation|application to incorporate|incorporation form)\b", text_l):
-        return "Incorporation Application Form"
+    best = None
+    for m in _DOC_TYPE_RE.finditer(text):
+        rank, doc_type = _DOC_TYPE_PRIORITY[m.lastgroup]
+        if best is None or rank < best[0]:
+            best = (rank, doc_type)
+            if rank == 0:
+                break
+    if best is not None:
+        return best[1]
     # short docs — use words rather than characters
-    word_count = len([w for w in re.split(r"\s+", text_l) if w.strip()])
+    word_count = len(text.split())
     if word_count < 40:
         return "Short Document"
-    # fallback - try to detect common contract headings
-    if re.search(r"\b(agreement|contract|terms|conditions)\b", text_l):
-        return "Commercial Agreement / Other"
+    # fallback - contract headings and anything else are treated alike
     return "Commercial Agreement / Other"
 
 
+# red-flag keyword groups; substring matches, like the original `in` checks
+_RED_FLAG_PATTERNS = [
+    ("jurisdiction", r"adgm|abu dhabi global market"),
+    ("signature", r"signature|signed"),
+]
+_RED_FLAG_RE = re.compile("|".join(f"(?P<{name}>{alts})" for name, alts in _RED_FLAG_PATTERNS), re.I)
+
+
+def detect_red_flag_markers(text: str) -> set:
+    """
+    Single pass over text; returns the red-flag categories whose keywords are present
+    (e.g. {"jurisdiction", "signature"}). Callers flag the categories that are missing.
+    """
+    found = set()
+    for m in _RED_FLAG_RE.finditer(text):
+        found.add(m.lastgroup)
+        if len(found) == len(_RED_FLAG_PATTERNS):
+            break
+    return found
+
+
 def detect_process(predicted_types) -> str:
     incorporation_keywords = set([
         "Articles of Association", "Memorandum of Association", "Incorporation Application Form", "UBO Declaration Form", "Register of Members and Directors"
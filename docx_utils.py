@@ -1,92 +1,123 @@
 # docx_utils.py
 from docx import Document
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
+def _parse_one(p):
+    doc = Document(p)
+    # para.text walks the runs on every access; read it once per paragraph
+    paras = []
+    for para in doc.paragraphs:
+        t = para.text
+        if t and t.strip():
+            paras.append(t)
+    full_text = "\n".join(paras)
+    return {"path": p, "text": full_text, "paragraphs": paras}
+
+
 def parse_docx_documents(paths):
-    out = []
-    for p in paths:
-        doc = Document(p)
-        paras = [para.text for para in doc.paragraphs if para.text and para.text.strip()]
-        full_text = "\n".join(paras)
-        out.append({"path": p, "text": full_text, "paragraphs": paras})
-    return out
+    """
+    Parse .docx files concurrently (zip/lxml parsing releases the GIL). Output order matches paths.
+    """
+    paths = list(paths)
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+        return list(ex.map(_parse_one, paths))
+
+
+def _build_paragraph_index(paragraphs):
+    """
+    Inverted index token -> set(paragraph_idx), built once per document.
+    Tokens follow the same rule as issue matching: lower-cased words longer than 3 chars.
+    """
+    index = defaultdict(set)
+    for i, para in enumerate(paragraphs):
+        for tok in re.split(r"\W+", para.text.lower()):
+            if len(tok) > 3:
+                index[tok].add(i)
+    return index
 
 
-def _find_paragraph_index_for_issue(doc, section, issue_text):
+def _find_paragraph_index_for_issue(index, section, issue_text):
     """
     Heuristic: prefer paragraphs which contain longer tokens from section or issue_text.
+    Section tokens weigh 2, issue tokens weigh 1; ties go to the earliest paragraph.
     Returns index of paragraph or None if not found.
     """
-    section_tokens = [t for t in re.split(r"\W+", (section or "").lower()) if len(t) > 3]
-    issue_tokens = [t for t in re.split(r"\W+", (issue_text or "").lower()) if len(t) > 3]
+    section_tokens = {t for t in re.split(r"\W+", (section or "").lower()) if len(t) > 3}
+    issue_tokens = {t for t in re.split(r"\W+", (issue_text or "").lower()) if len(t) > 3}
 
-    best_idx = None
-    best_score = 0
-    for i, para in enumerate(doc.paragraphs):
-        pl = para.text.lower()
-        score = 0
-        for tok in section_tokens:
-            if tok in pl:
-                score += 2
-        for tok in issue_tokens:
-            if tok in pl:
-                score += 1
-        if score > best_score:
-            best_score = score
-            best_idx = i
+    scores = defaultdict(int)
+    for tok in section_tokens:
+        for i in index.get(tok, ()):
+            scores[i] += 2
+    for tok in issue_tokens:
+        for i in index.get(tok, ()):
+            scores[i] += 1
     # require at least a minimal score to accept match
-    if best_score >= 1:
-        return best_idx
-    return None
+    if not scores:
+        return None
+    return min(scores, key=lambda i: (-scores[i], i))
 
 
-def _insert_after_paragraph(doc, para_index, text, author="ADGM-Agent"):
+def _append_note_runs(p_elm, notes, italic=True):
     """
-    Insert a new paragraph after para_index. Uses docx API to add paragraph then move it.
-    Returns True if inserted, False otherwise.
+    Append one run per note to the w:p element p_elm, separated by line breaks.
+    Builds the runs directly with OxmlElement so a whole bucket of notes costs one paragraph.
     """
-    try:
-        # Create a new paragraph at the end then move it after the target paragraph
-        after = doc.add_paragraph()
-        run = after.add_run(text)
-        # Basic formatting to make it look like a review comment
-        run.italic = True
-        run.bold = False
-
-        # Try to reposition the newly added paragraph to after the target paragraph
-        p = doc.paragraphs[para_index]
-        p_elm = p._p
-        after_elm = after._p
-        p_elm.addnext(after_elm)
-        return True
-    except Exception:
-        # If anything fails, fall back to append (we already added it)
-        return True
+    for n, text in enumerate(notes):
+        r = OxmlElement("w:r")
+        if italic:
+            # Basic formatting to make it look like a review comment
+            rPr = OxmlElement("w:rPr")
+            rPr.append(OxmlElement("w:i"))
+            r.append(rPr)
+        if n:
+            r.append(OxmlElement("w:br"))
+        t = OxmlElement("w:t")
+        t.set(qn("xml:space"), "preserve")
+        t.text = text
+        r.append(t)
+        p_elm.append(r)
+    return p_elm
 
 
 def insert_review_notes_and_save(original_path, issues, out_path):
     """
     Insert review notes into the docx and save to out_path.
-    For each issue, attempt to locate a best paragraph and insert a review paragraph immediately after it.
-    If location can't be determined, append a general note at the end.
+    Issues are bucketed by their best-matching paragraph; each bucket becomes a single review
+    paragraph inserted immediately after that paragraph. Issues that can't be located are
+    collected into one general-notes paragraph appended at the end.
     """
     doc = Document(original_path)
+    # snapshot paragraphs before inserting notes so indices stay valid and notes aren't matched
+    paragraphs = doc.paragraphs
+    index = _build_paragraph_index(paragraphs)
+    buckets = defaultdict(list)
+    general_notes = []
     for iss in issues:
         section = iss.get("section", "")
         note_text = f"REVIEW NOTE (severity={iss.get('severity','Medium')}): {iss.get('issue')}. Suggestion: {iss.get('suggestion','')}"
-        inserted = False
+        idx = None
         if section:
             try:
-                idx = _find_paragraph_index_for_issue(doc, section, iss.get('issue', ''))
-                if idx is not None:
-                    _insert_after_paragraph(doc, idx, note_text)
-                    inserted = True
+                idx = _find_paragraph_index_for_issue(index, section, iss.get('issue', ''))
             except Exception:
-                inserted = False
-        if not inserted:
-            # fallback: append a clearly identifiable review note at end
-            doc.add_paragraph(f"REVIEW NOTE (general): {note_text}")
+                idx = None
+        if idx is not None:
+            buckets[idx].append(note_text)
+        else:
+            # fallback: a clearly identifiable review note at end
+            general_notes.append(f"REVIEW NOTE (general): {note_text}")
+
+    for idx, notes in buckets.items():
+        p_elm = _append_note_runs(OxmlElement("w:p"), notes)
+        paragraphs[idx]._p.addnext(p_elm)
+    if general_notes:
+        _append_note_runs(doc.add_paragraph()._p, general_notes, italic=False)
     doc.save(out_path)
     return out_path
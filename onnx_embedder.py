@@ -0,0 +1,85 @@
+# onnx_embedder.py
+# CPU embedding backend: MiniLM exported to ONNX, int8 dynamic-quantized, run with ONNX Runtime.
+# rag_utils uses it when ADGM_EMBED_BACKEND=onnx, `optimum` and `onnxruntime` are installed and
+# no GPU is available, and falls back to SentenceTransformer otherwise.
+import os
+
+# optional dependencies (we'll handle if missing)
+try:
+    import numpy as np
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+except Exception:
+    ort = None
+
+ONNX_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = os.path.join(".onnx_models", "all-MiniLM-L6-v2")
+_FP32_FILE = "model.onnx"
+_INT8_FILE = "model_quantized.onnx"
+
+
+def available():
+    return ort is not None
+
+
+def _export_model(model_dir):
+    """
+    Export the HF model to ONNX and write an int8 dynamic-quantized copy next to it.
+    Only runs once; later loads reuse the files in model_dir.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(ONNX_MODEL_ID, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(ONNX_MODEL_ID).save_pretrained(model_dir)
+    quantize_dynamic(
+        os.path.join(model_dir, _FP32_FILE),
+        os.path.join(model_dir, _INT8_FILE),
+        weight_type=QuantType.QInt8,
+    )
+
+
+class OnnxEmbedder:
+    """
+    Drop-in for the subset of SentenceTransformer.encode used here: mean pooling over the
+    last hidden state, optional L2 normalization, numpy output.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, max_seq_length=256):
+        if ort is None:
+            raise RuntimeError("onnxruntime / optimum not installed.")
+        if not os.path.exists(os.path.join(model_dir, _INT8_FILE)):
+            _export_model(model_dir)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, _INT8_FILE), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        # show_progress_bar / convert_to_numpy / device are accepted for compatibility; output is always numpy
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        out = []
+        for start in range(0, len(sentences), batch_size):
+            enc = self.tokenizer(
+                list(sentences[start:start + batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(out, axis=0)
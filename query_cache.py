@@ -0,0 +1,61 @@
+# query_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_query_key(query_text, suffix=None):
+    """
+    Stable cache key for a query: SHA-256 of the normalized (stripped, lower-cased) text,
+    optionally followed by ':<suffix>' (e.g. top_k).
+    """
+    digest = hashlib.sha256((query_text or "").strip().lower().encode("utf-8")).hexdigest()
+    if suffix is None:
+        return digest
+    return f"{digest}:{suffix}"
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL.
+    Entries older than ttl_seconds are treated as misses; the least recently used
+    entry is evicted once max_size is exceeded. ttl_seconds=None disables expiry.
+    """
+
+    def __init__(self, max_size=2000, ttl_seconds=600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop a single key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -1,9 +1,16 @@
 # rag_utils.py
 import os
 import glob
+import logging
+import json
 import re
 import importlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from query_cache import QueryCache, make_query_key
+import sqlite_vec_store
+import onnx_embedder
 
 # optional import for Gemini (we'll handle if missing)
 try:
@@ -11,6 +18,13 @@ try:
 except Exception:
     genai = None
 
+# Streamlit's resource cache keeps one shared instance across reruns; plain memoization outside Streamlit
+try:
+    import streamlit as st
+    _cache_resource = st.cache_resource
+except Exception:
+    _cache_resource = functools.lru_cache(maxsize=None)
+
 # ---------------------------------------
 # Chroma init (support old and new APIs)
 # ---------------------------------------
@@ -26,32 +40,80 @@ except Exception as e:
     # caller should handle missing chromadb
 
 # Client selection
-_chroma_client = None
-try:
-    if chromadb and hasattr(chromadb, "PersistentClient"):
-        # old API
-        _chroma_client = chromadb.PersistentClient(path=_chroma_path)
-    else:
+@_cache_resource
+def get_chroma_client():
+    try:
+        if chromadb and hasattr(chromadb, "PersistentClient"):
+            # old API
+            return chromadb.PersistentClient(path=_chroma_path)
         # new API
         from chromadb import Client
         from chromadb.config import Settings
-        _chroma_client = Client(Settings(persist_directory=_chroma_path))
-except Exception:
-    _chroma_client = None
+        return Client(Settings(persist_directory=_chroma_path))
+    except Exception:
+        return None
+
+
+_chroma_client = get_chroma_client()
 
 COLLECTION_NAME = "adgm_refs"
+# embeddings are unit-normalized on both sides, so inner product ranks like cosine without the norm work
+COLLECTION_METADATA = {"hnsw:space": "ip"}
+CHROMA_ADD_BATCH_SIZE = 1000
+
+# Vector backend: "chroma" (default) or "sqlite-vec" for single-process deployments.
+# Falls back to Chroma when sqlite-vec isn't installed.
+VECTOR_BACKEND = os.getenv("ADGM_VECTOR_BACKEND", "chroma").strip().lower()
+SQLITE_VEC_PATH = os.path.join(".sqlite_vec", f"{COLLECTION_NAME}.db")
+if VECTOR_BACKEND == "sqlite-vec" and not sqlite_vec_store.available():
+    logging.warning(
+        "ADGM_VECTOR_BACKEND=sqlite-vec but the sqlite-vec package or SQLite extension loading "
+        "is unavailable; using Chroma."
+    )
 
 # Embedding model lazy-loaded
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-_embed_model = None
+EMBED_MAX_SEQ_LENGTH = 256
+# Embedding backend: "torch" (default, SentenceTransformer) or "onnx" (int8 ONNX Runtime on CPU)
+EMBED_BACKEND = os.getenv("ADGM_EMBED_BACKEND", "torch").strip().lower()
+# MiniLM only sees the first 256 tokens; ~1500 chars covers that, so don't tokenize the rest
+MAX_QUERY_CHARS = 1500
+
+# Retrieval caches: joined clause strings per (query, top_k), and raw query embeddings per query
+_result_cache = QueryCache(max_size=2000, ttl_seconds=600)
+_query_embedding_cache = QueryCache(max_size=2000, ttl_seconds=600)
+
+
+def _embed_device():
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except Exception:
+        return "cpu"
+
+
+@_cache_resource
+def get_embed_model():
+    device = _embed_device()
+    # opt-in int8 ONNX Runtime model on CPU; vectors differ from the torch model, so re-ingest after switching
+    if EMBED_BACKEND == "onnx":
+        if device != "cpu":
+            logging.warning(f"ADGM_EMBED_BACKEND=onnx ignored on {device}; using SentenceTransformer.")
+        elif not onnx_embedder.available():
+            logging.warning("ADGM_EMBED_BACKEND=onnx but optimum/onnxruntime not installed; using SentenceTransformer.")
+        else:
+            try:
+                return onnx_embedder.OnnxEmbedder(max_seq_length=EMBED_MAX_SEQ_LENGTH)
+            except Exception as e:
+                logging.warning(f"ONNX embedder failed to load ({e}); using SentenceTransformer.")
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBED_MODEL_NAME, device=device)
+    model.max_seq_length = EMBED_MAX_SEQ_LENGTH
+    return model
 
 
 def _load_embed_model():
-    global _embed_model
-    if _embed_model is None:
-        from sentence_transformers import SentenceTransformer
-        _embed_model = SentenceTransformer(EMBED_MODEL_NAME)
-    return _embed_model
+    return get_embed_model()
 
 
 def api_key_available():
@@ -68,7 +130,13 @@ def _ensure_gemini_configured():
     genai.configure(api_key=api_key)
 
 
+def _use_sqlite_vec():
+    return VECTOR_BACKEND == "sqlite-vec" and sqlite_vec_store.available()
+
+
 def collection_exists():
+    if _use_sqlite_vec():
+        return sqlite_vec_store.collection_exists(SQLITE_VEC_PATH)
     if _chroma_client is None:
         return False
     try:
@@ -90,10 +158,50 @@ def collection_exists():
         return False
 
 
-def ingest_reference_documents(refs_folder="adgm_refs"):
+def _read_reference_text(p):
+    if p.lower().endswith(".docx"):
+        from docx import Document
+        # para.text walks the runs on every access; read it once per paragraph
+        paras = []
+        for para in Document(p).paragraphs:
+            t = para.text
+            if t.strip():
+                paras.append(t)
+        return "\n".join(paras)
+    with open(p, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+def _parse_and_chunk(i, p):
     """
-    Ingest local reference docs into Chroma. Compatible with old/new chroma APIs.
+    Read one reference file and split it into ~800-char sentence chunks.
+    Returns (docs, metadatas, ids) for that file; ids are '<file index>_<chunk index>'.
     """
+    text = _read_reference_text(p)
+    source = os.path.basename(p)
+    docs, metadatas, ids = [], [], []
+
+    def flush(buf):
+        chunk = " ".join(buf).strip()
+        if chunk:
+            docs.append(chunk)
+            metadatas.append({"source": source})
+            ids.append(f"{i}_{len(ids)}")
+
+    # accumulate sentences in a list (each counts len + 1 for its separator) and join once per chunk
+    buf, buflen = [], 0
+    for sent in re.split(r'(?<=[\.\?\!])\s+', text):
+        slen = len(sent) + 1
+        if buflen + slen > 800:
+            flush(buf)
+            buf, buflen = [], 0
+        buf.append(sent)
+        buflen += slen
+    flush(buf)
+    return docs, metadatas, ids
+
+
+def _recreate_chroma_collection():
     if _chroma_client is None:
         raise RuntimeError("ChromaDB client not available. Install chromadb and try again.")
 
@@ -105,85 +213,140 @@ def ingest_reference_documents(refs_folder="adgm_refs"):
 
     # create collection - API differs, but both expose create_collection or similar
     try:
-        collection = _chroma_client.create_collection(name=COLLECTION_NAME)
+        return _chroma_client.create_collection(name=COLLECTION_NAME, metadata=COLLECTION_METADATA)
     except Exception as e:
         # new Client API may require other args; try to create in alternate way
         try:
-            collection = _chroma_client.create_collection(COLLECTION_NAME)
+            return _chroma_client.create_collection(COLLECTION_NAME, metadata=COLLECTION_METADATA)
         except Exception:
             raise RuntimeError(f"Failed to create Chroma collection: {e}")
 
+
+def ingest_reference_documents(refs_folder="adgm_refs"):
+    """
+    Ingest local reference docs into the vector store (Chroma, or sqlite-vec when selected).
+    Compatible with old/new chroma APIs.
+    """
+    use_sqlite_vec = _use_sqlite_vec()
+    collection = None if use_sqlite_vec else _recreate_chroma_collection()
+
     # gather documents
     paths = glob.glob(os.path.join(refs_folder, "*"))
     if not paths:
         raise FileNotFoundError(f"No reference files found in '{refs_folder}'.")
 
+    # parse + chunk reference files concurrently; order is preserved so chunk ids stay stable
+    with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+        parsed = list(ex.map(_parse_and_chunk, range(len(paths)), paths))
+
     docs, metadatas, ids = [], [], []
-    for i, p in enumerate(paths):
-        text = ""
-        if p.lower().endswith(".docx"):
-            from docx import Document
-            paras = [para.text for para in Document(p).paragraphs if para.text.strip()]
-            text = "\n".join(paras)
-        else:
-            with open(p, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-
-        sentences = re.split(r'(?<=[\.\?\!])\s+', text)
-        current, chunk_id = "", 0
-        for sent in sentences:
-            if len(current) + len(sent) + 1 <= 800:
-                current += sent + " "
-            else:
-                if current.strip():
-                    docs.append(current.strip())
-                    metadatas.append({"source": os.path.basename(p)})
-                    ids.append(f"{i}_{chunk_id}")
-                    chunk_id += 1
-                current = sent + " "
-        if current.strip():
-            docs.append(current.strip())
-            metadatas.append({"source": os.path.basename(p)})
-            ids.append(f"{i}_{chunk_id}")
+    for file_docs, file_metas, file_ids in parsed:
+        docs.extend(file_docs)
+        metadatas.extend(file_metas)
+        ids.extend(file_ids)
 
     if not docs:
         raise ValueError("No document chunks created for ingestion.")
 
     # embed and add
-    embeddings = _load_embed_model().encode(docs, show_progress_bar=True, convert_to_numpy=True)
-    # Depending on API, collection.add may accept lists similarly
-    try:
-        collection.add(ids=ids, documents=docs, metadatas=metadatas, embeddings=embeddings.tolist())
-    except Exception:
-        # try alternative arg order if needed by some versions
-        try:
-            collection.add(documents=docs, metadatas=metadatas, ids=ids, embeddings=embeddings.tolist())
-        except Exception as e:
-            raise RuntimeError(f"Failed to add to Chroma collection: {e}")
+    # Vectors stay float32: Chroma's hnswlib index stores float32 regardless of input, so int8
+    # scalar quantization here would cost recall without saving any index memory or distance work.
+    embeddings = _load_embed_model().encode(
+        docs,
+        batch_size=64,
+        show_progress_bar=True,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+    if use_sqlite_vec:
+        sqlite_vec_store.rebuild(SQLITE_VEC_PATH, ids, docs, metadatas, embeddings)
+    else:
+        # The pinned Chroma (0.3.x) expects list embeddings; convert slice by slice so we never
+        # hold the whole (N, dim) array as Python floats at once.
+        for start in range(0, len(docs), CHROMA_ADD_BATCH_SIZE):
+            end = start + CHROMA_ADD_BATCH_SIZE
+            batch_embeddings = embeddings[start:end].tolist()
+            # Depending on API, collection.add may accept lists similarly
+            try:
+                collection.add(ids=ids[start:end], documents=docs[start:end], metadatas=metadatas[start:end], embeddings=batch_embeddings)
+            except Exception:
+                # try alternative arg order if needed by some versions
+                try:
+                    collection.add(documents=docs[start:end], metadatas=metadatas[start:end], ids=ids[start:end], embeddings=batch_embeddings)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to add to Chroma collection: {e}")
 
-    print(f"Ingested {len(docs)} chunks into '{COLLECTION_NAME}'.")
+    # cached retrieval results refer to the previous collection contents
+    _result_cache.invalidate()
+    print(f"Ingested {len(docs)} chunks into '{COLLECTION_NAME}' ({'sqlite-vec' if use_sqlite_vec else 'chroma'}).")
 
 
-def retrieve_relevant_clauses(query_text, top_k=3):
-    if _chroma_client is None:
-        return ""
-    try:
-        coll = _chroma_client.get_collection(COLLECTION_NAME)
-    except Exception:
-        return ""
+def _embed_queries(query_texts):
+    """
+    Return one embedding per query text, encoding all cache misses in a single model call.
+    """
+    keys = [make_query_key(q) for q in query_texts]
+    vectors = [_query_embedding_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        encoded = _load_embed_model().encode(
+            [query_texts[i] for i in missing],
+            batch_size=32,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        for i, vec in zip(missing, encoded):
+            vectors[i] = vec
+            _query_embedding_cache.put(keys[i], vec)
+    return vectors
+
+
+def retrieve_relevant_clauses_batch(query_texts, top_k=3):
+    """
+    Retrieve relevant reference clauses for several queries at once.
+    Returns a list of joined clause strings, positionally aligned with query_texts.
+    """
+    query_texts = [(q or "")[:MAX_QUERY_CHARS] for q in query_texts]
+    use_sqlite_vec = _use_sqlite_vec()
+    if (_chroma_client is None and not use_sqlite_vec) or not query_texts:
+        return ["" for _ in query_texts]
+
+    cache_keys = [make_query_key(q, top_k) for q in query_texts]
+    out = [_result_cache.get(k) for k in cache_keys]
+    pending = [i for i, r in enumerate(out) if r is None]
+    if not pending:
+        return out
+
+    if use_sqlite_vec:
+        if not sqlite_vec_store.collection_exists(SQLITE_VEC_PATH):
+            return [r if r is not None else "" for r in out]
+        q_embs = _embed_queries([query_texts[i] for i in pending])
+        doclists = sqlite_vec_store.query(SQLITE_VEC_PATH, q_embs, top_k=top_k)
+    else:
+        try:
+            coll = _chroma_client.get_collection(COLLECTION_NAME)
+        except Exception:
+            return [r if r is not None else "" for r in out]
 
-    q_emb = _load_embed_model().encode([query_text])[0].tolist()
-    try:
-        results = coll.query(query_embeddings=[q_emb], n_results=top_k, include=["documents", "metadatas"])
-    except Exception:
-        # try alternative signature
-        results = coll.query(query_embeddings=[q_emb], n_results=top_k, include=["documents"])
+        q_embs = [v.tolist() for v in _embed_queries([query_texts[i] for i in pending])]
+        try:
+            results = coll.query(query_embeddings=q_embs, n_results=top_k, include=["documents", "metadatas"])
+        except Exception:
+            # try alternative signature
+            results = coll.query(query_embeddings=q_embs, n_results=top_k, include=["documents"])
+        doclists = results.get("documents") or []
+
+    # both backends return one document list per query embedding, in order
+    for pos, i in enumerate(pending):
+        docs = doclists[pos] if pos < len(doclists) else []
+        joined = "\n\n---\n\n".join(docs)
+        _result_cache.put(cache_keys[i], joined)
+        out[i] = joined
+    return out
 
-    docs = []
-    for doclist in results.get("documents", []):
-        docs.extend(doclist)
-    # Also try to include metadata excerpts if available
-    return "\n\n---\n\n".join(docs)
+
+def retrieve_relevant_clauses(query_text, top_k=3):
+    return retrieve_relevant_clauses_batch([query_text], top_k=top_k)[0]
 
 
 def _clean_gemini_output(output: str) -> str:
@@ -195,6 +358,27 @@ def _clean_gemini_output(output: str) -> str:
     return cleaned
 
 
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+    "response_mime_type": "text/plain",
+}
+
+# GenerativeModel instances keyed by (model_name, generation_config as sorted JSON)
+_model_cache = {}
+
+
+def _get_gemini_model(model_name, generation_config):
+    key = (model_name, json.dumps(generation_config, sort_keys=True))
+    model = _model_cache.get(key)
+    if model is None:
+        model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        _model_cache[key] = model
+    return model
+
+
 def call_gemini_with_context(prompt: str, system_message: str = None, model_name: str = "gemini-1.5-flash"):
     """
     Single call to Gemini. Raises on missing API or returns None if call fails.
@@ -206,20 +390,46 @@ def call_gemini_with_context(prompt: str, system_message: str = None, model_name
         raise ValueError("GEMINI_API_KEY not set.")
     _ensure_gemini_configured()
     try:
-        generation_config = {
-            "temperature": 0.0,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 2048,
-            "response_mime_type": "text/plain",
-        }
-        model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        model = _get_gemini_model(model_name, GEMINI_GENERATION_CONFIG)
         combined_prompt = f"{system_message}\n\n{prompt}" if system_message else prompt
-        chat_session = model.start_chat(history=[])
-        response = chat_session.send_message(combined_prompt)
+        # stateless single-shot request; no chat session needed
+        response = model.generate_content(combined_prompt)
         if response and hasattr(response, "text"):
             return _clean_gemini_output(response.text)
         return None
     except Exception as e:
         # propagate the exception message so caller can log and fallback
         raise RuntimeError(f"Gemini call failed: {e}")
+
+
+# cap on concurrent per-document Gemini requests, to stay under the per-minute quota
+GEMINI_BATCH_MAX_WORKERS = 4
+
+
+def call_gemini_batch(prompts, system_message: str = None, model_name: str = "gemini-1.5-flash"):
+    """
+    Send several independent prompts to Gemini concurrently on a small thread pool.
+    Returns (text, error) pairs aligned with prompts: text is the cleaned response, or None
+    with error set to the exception when that call failed.
+    """
+    if genai is None:
+        raise RuntimeError("google-generativeai package not installed.")
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not set.")
+    _ensure_gemini_configured()
+    model = _get_gemini_model(model_name, GEMINI_GENERATION_CONFIG)
+    combined_prompts = [f"{system_message}\n\n{p}" if system_message else p for p in prompts]
+    if not combined_prompts:
+        return []
+
+    def _call(prompt):
+        try:
+            response = model.generate_content(prompt)
+            # .text raises ValueError when the candidate was blocked / empty
+            return _clean_gemini_output(response.text), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=min(GEMINI_BATCH_MAX_WORKERS, len(combined_prompts))) as ex:
+        return list(ex.map(_call, combined_prompts))
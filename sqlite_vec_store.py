@@ -0,0 +1,105 @@
+# sqlite_vec_store.py
+# Single-file vector store backed by the sqlite-vec extension. rag_utils uses it instead of
+# Chroma when ADGM_VECTOR_BACKEND=sqlite-vec and the `sqlite-vec` package is installed.
+import os
+import sqlite3
+
+# optional dependency (we'll handle if missing)
+try:
+    import sqlite_vec
+except Exception:
+    sqlite_vec = None
+
+CHUNKS_TABLE = "chunks"
+VEC_TABLE = "vec_chunks"
+
+
+def available():
+    return sqlite_vec is not None and hasattr(sqlite3.Connection, "enable_load_extension")
+
+
+def _connect(db_path):
+    if sqlite_vec is None:
+        raise RuntimeError("sqlite-vec package not installed.")
+    conn = sqlite3.connect(db_path)
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+    return conn
+
+
+def _to_blob(vec):
+    # sqlite-vec takes float vectors as packed little-endian float32
+    return vec.astype("float32", copy=False).tobytes()
+
+
+def collection_exists(db_path):
+    if not os.path.exists(db_path):
+        return False
+    try:
+        conn = _connect(db_path)
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (VEC_TABLE,)
+            ).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+    except Exception:
+        return False
+
+
+def rebuild(db_path, ids, docs, metadatas, embeddings):
+    """
+    Replace the stored chunks with docs/embeddings (numpy array of shape (N, dim)).
+    Chunk i is stored with rowid i + 1 in both tables.
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {VEC_TABLE}")
+            conn.execute(f"DROP TABLE IF EXISTS {CHUNKS_TABLE}")
+            conn.execute(
+                f"CREATE TABLE {CHUNKS_TABLE} (rowid INTEGER PRIMARY KEY, chunk_id TEXT, document TEXT, source TEXT)"
+            )
+            conn.execute(f"CREATE VIRTUAL TABLE {VEC_TABLE} USING vec0(embedding float[{embeddings.shape[1]}])")
+            conn.executemany(
+                f"INSERT INTO {CHUNKS_TABLE} (rowid, chunk_id, document, source) VALUES (?, ?, ?, ?)",
+                (
+                    (n + 1, chunk_id, doc, (meta or {}).get("source"))
+                    for n, (chunk_id, doc, meta) in enumerate(zip(ids, docs, metadatas))
+                ),
+            )
+            conn.executemany(
+                f"INSERT INTO {VEC_TABLE} (rowid, embedding) VALUES (?, ?)",
+                ((n + 1, _to_blob(vec)) for n, vec in enumerate(embeddings)),
+            )
+    finally:
+        conn.close()
+
+
+def query(db_path, query_embeddings, top_k=3):
+    """
+    KNN search for each query vector. Returns one list of chunk texts per query, nearest first.
+    """
+    conn = _connect(db_path)
+    try:
+        out = []
+        for vec in query_embeddings:
+            rows = conn.execute(
+                f"""
+                SELECT c.document
+                FROM (
+                    SELECT rowid, distance FROM {VEC_TABLE}
+                    WHERE embedding MATCH ? AND k = ?
+                ) knn
+                JOIN {CHUNKS_TABLE} c ON c.rowid = knn.rowid
+                ORDER BY knn.distance
+                """,
+                (_to_blob(vec), top_k),
+            ).fetchall()
+            out.append([r[0] for r in rows])
+        return out
+    finally:
+        conn.close()